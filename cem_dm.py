@@ -69,8 +69,8 @@ def cem_planner(pool, action_spec, state, horizon, proposals, topk, iterations,
     for _ in range(iterations):
         plans = np.random.normal(mean, std, size=(proposals,) + mean.shape)
         scores = pool.map(partial(evaluate, state=state), plans)
-        plans = plans[np.argsort(scores)]
-        mean, std = plans[-topk:].mean(axis=0), plans[-topk:].std(axis=0)
+        elites = plans[np.argpartition(scores, -topk)[-topk:]]
+        mean, std = elites.mean(axis=0), elites.std(axis=0)
 
     return mean[0]
 
@@ -4,6 +4,7 @@ Example usage:
 python cem_gym.py MyHalfCheetah-v2 -a gaussian -r 4 -l 12
 """
 import argparse
+import math
 import numpy as np
 from multiprocessing import Pool
 from functools import partial
@@ -14,6 +15,9 @@ import env # Register environments
 from utils import Logger
 
 
+NUM_WORKERS = 32
+
+
 class ActionRepeat(object):
     def __init__(self, env, amount):
         self._env = env
@@ -33,6 +37,13 @@ class ActionRepeat(object):
         return self._env.sim
 
     def step(self, action):
+        if self.amount > 1 and getattr(self._env.unwrapped, 'supports_action_repeat', False):
+            # Repeat action in a single simulation call, bypassing the time limit wrapper
+            obs, total_reward, done, _ = self._env.unwrapped.step(action, repeat=self.amount)
+            self._env._elapsed_steps += self.amount
+            done = done or self._env._elapsed_steps >= self._env._max_episode_steps
+            return obs, total_reward, done, {}
+
         total_reward = 0
 
         for _ in range(self.amount):
@@ -46,15 +57,22 @@ class ActionRepeat(object):
     def reset(self, *args, **kwargs):
         return self._env.reset(*args, **kwargs)
 
+    def set_state(self, state):
+        # Start a new episode from a flattened simulator state, only the simulator is reset
+        # so no data such as solver warmstart carries over from the previous rollout
+        self._env._elapsed_steps = 0
+        self._env.sim.reset()
+        self._env.sim.set_state_from_flattened(state)
+
 
 def initializer(env):
     global global_env
     global_env = env
+    global_env.reset()
 
 
 def evaluate(actions, state):
-    global_env.reset()
-    global_env.sim.set_state(state)
+    global_env.set_state(state)
 
     score = 0
     for action in actions:
@@ -66,54 +84,108 @@ def evaluate(actions, state):
     return score
 
 
-def gaussian_cem(state, pool, action_space, horizon, proposals, topk, iterations):
+def evaluate_plans(pool, plans, state):
+    # Send a few chunks of plans to each worker, so that workers done early with cheap
+    # plans of terminated episodes pick up more, the state is pickled once per chunk
+    chunksize = math.ceil(len(plans) / (4 * NUM_WORKERS))
+    return pool.map(partial(evaluate, state=state), plans, chunksize=chunksize)
+
+
+def colored_noise(rng, beta, size):
+    # Gaussian noise with unit variance and power spectral density proportional to 1 / f^beta
+    # along the last dimension, beta = 0 gives white noise
+    samples = size[-1]
+    freqs = np.fft.rfftfreq(samples)
+    freqs[0] = 1. / samples
+    scale = freqs ** (-beta / 2.)
+
+    variance = 2 * scale[0] ** 2 + 4 * np.sum(scale[1:] ** 2)
+    if samples % 2 == 0:
+        variance -= 2 * scale[-1] ** 2
+    sigma = np.sqrt(variance) / samples
+
+    real = rng.standard_normal(size[:-1] + (len(freqs),)) * scale
+    imag = rng.standard_normal(size[:-1] + (len(freqs),)) * scale
+    # Zero and Nyquist frequency components of a real signal are real
+    if samples % 2 == 0:
+        imag[..., -1] = 0
+        real[..., -1] *= np.sqrt(2)
+    imag[..., 0] = 0
+    real[..., 0] *= np.sqrt(2)
+
+    return np.fft.irfft(real + 1j * imag, n=samples) / sigma
+
+
+def gaussian_cem(state, pool, rng, action_space, horizon, proposals, topk, iterations, beta, tol):
     action_bound = action_space.high[0]
     mean = np.zeros((horizon,) + action_space.shape)
-    std = np.ones((horizon,) + action_space.shape) * action_bound
+    std = np.full((horizon,) + action_space.shape, action_bound, dtype=float)
+
+    # Buffer refilled in place at every iteration
+    clipped_plans = np.empty((proposals,) + mean.shape)
 
     for _ in range(iterations):
-        plans = np.random.normal(mean, std, size=(proposals,) + mean.shape)
-        scores = pool.map(partial(evaluate, state=state), plans.clip(-action_bound, action_bound))
-        elites = plans[np.argsort(scores)][-topk:]
-        mean, std = elites.mean(axis=0), elites.std(axis=0)
+        # Noise correlated over the planning horizon, turned into plans in place
+        noise = colored_noise(rng, beta, (proposals,) + action_space.shape + (horizon,))
+        plans = np.moveaxis(noise, -1, 1)
+        plans *= std
+        plans += mean
+        np.clip(plans, -action_bound, action_bound, out=clipped_plans)
+        scores = evaluate_plans(pool, clipped_plans, state)
+        elites = plans[np.argpartition(scores, -topk)[-topk:]]
+        elites.mean(axis=0, out=mean)
+        elites.std(axis=0, out=std)
+
+        # Stop once the sampling distribution has collapsed
+        if np.max(std) < tol * action_bound:
+            break
 
     # Return first action of mean of last iteration
     return mean[0].clip(-action_bound, action_bound)
 
 
-def nonparametric_cem(state, pool, action_space, horizon, proposals, topk, iterations, sigma):
+def nonparametric_cem(state, pool, rng, action_space, horizon, proposals, topk, iterations, sigma):
     action_bound = action_space.high[0]
-    plans = np.random.randn(proposals, horizon, *action_space.shape) * action_bound
+    plans = rng.standard_normal((proposals, horizon) + action_space.shape) * action_bound
+
+    # Buffers refilled in place at every iteration
+    noise = np.empty_like(plans)
+    clipped_plans = np.empty_like(plans)
 
     for _ in range(iterations - 1):
-        scores = pool.map(partial(evaluate, state=state), plans.clip(-action_bound, action_bound))
-        elites = plans[np.argsort(scores)][-topk:]
-        means = elites[np.random.randint(topk, size=proposals)]
-        noise = np.random.randn(*means.shape) * sigma * action_bound
-        plans = means + noise
+        np.clip(plans, -action_bound, action_bound, out=clipped_plans)
+        scores = evaluate_plans(pool, clipped_plans, state)
+        elites = plans[np.argpartition(scores, -topk)[-topk:]]
+        np.take(elites, rng.integers(topk, size=proposals), axis=0, out=plans)
+        rng.standard_normal(out=noise)
+        noise *= sigma * action_bound
+        plans += noise
 
     # Return first action of best plan of last iteration
-    scores = pool.map(partial(evaluate, state=state), plans.clip(-action_bound, action_bound))
-    return plans[np.argsort(scores)][-1, 0].clip(-action_bound, action_bound)
+    np.clip(plans, -action_bound, action_bound, out=clipped_plans)
+    scores = evaluate_plans(pool, clipped_plans, state)
+    return plans[np.argmax(scores), 0].clip(-action_bound, action_bound)
 
 
 def main(args):
     param_str = (f'{args.env}_{args.algo}_rep={args.repeat}_hor={args.horizon}_prop={args.proposals}'
-                 f'_iter={args.iterations}_sigma={args.sigma}')
+                 f'_iter={args.iterations}_sigma={args.sigma}_beta={args.beta}_tol={args.tol}')
 
     env = gym.make(args.env)
     env = ActionRepeat(env, args.repeat)
 
     # Pool of workers, each has its own copy of global environment variable
-    pool = Pool(32, initializer, [env])
+    pool = Pool(NUM_WORKERS, initializer, [env])
+    rng = np.random.default_rng(args.seed)
 
     if args.algo == 'gaussian':
-        planner = partial(gaussian_cem, pool=pool, action_space=env.action_space, horizon=args.horizon,
-                          proposals=args.proposals, topk=args.topk, iterations=args.iterations)
+        planner = partial(gaussian_cem, pool=pool, rng=rng, action_space=env.action_space,
+                          horizon=args.horizon, proposals=args.proposals, topk=args.topk,
+                          iterations=args.iterations, beta=args.beta, tol=args.tol)
     elif args.algo == 'nonparametric':
-        planner = partial(nonparametric_cem, pool=pool, action_space=env.action_space, horizon=args.horizon,
-                          proposals=args.proposals, topk=args.topk, iterations=args.iterations,
-                          sigma = args.sigma)
+        planner = partial(nonparametric_cem, pool=pool, rng=rng, action_space=env.action_space,
+                          horizon=args.horizon, proposals=args.proposals, topk=args.topk,
+                          iterations=args.iterations, sigma = args.sigma)
 
     scores = np.zeros(args.episodes)
     observations = np.zeros((args.episodes, env.num_steps + 1) + env.observation_space.shape)
@@ -124,7 +196,7 @@ def main(args):
         observations[i, 0] = env.reset()
 
         for t in range(env.num_steps):
-            state = env.sim.get_state()
+            state = env.sim.get_state().flatten()
             actions[i, t] = planner(state)
             observations[i, t + 1], reward, _, _ = env.step(actions[i, t])
             scores[i] += reward
@@ -164,6 +236,14 @@ if __name__ == '__main__':
                         help='Number of optimization iterations for each action sequence.')
     parser.add_argument('--sigma', type=float, default=0.1,
                         help='Standard deviation of noise for nonparametric version.')
+    parser.add_argument('-s', '--seed', type=int, default=None,
+                        help='Random seed of the planner, drawn from the OS if not set.')
+    parser.add_argument('-b', '--beta', type=float, default=2.5,
+                        help='Exponent of the power spectral density of noise for gaussian version, '
+                             '0 gives white noise.')
+    parser.add_argument('-t', '--tol', type=float, default=0.05,
+                        help='Gaussian version stops iterating once the standard deviation of '
+                             'elites is below tol * action bound.')
     parser.add_argument('--logdir', type=str, default='runs/cem_gym',
                         help='Tensorboard log directory.')
     parser.add_argument('--save', action='store_true',
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 from multiprocessing import Pool
 from functools import partial
@@ -9,6 +10,7 @@ import env # Register environments
 
 
 ENV = 'MySwimmer-v2'
+NUM_WORKERS = 32
 
 
 class ActionRepeat(object):
@@ -30,6 +32,13 @@ class ActionRepeat(object):
         return self._env.sim
 
     def step(self, action):
+        if self.amount > 1 and getattr(self._env.unwrapped, 'supports_action_repeat', False):
+            # Repeat action in a single simulation call, bypassing the time limit wrapper
+            obs, total_reward, done, _ = self._env.unwrapped.step(action, repeat=self.amount)
+            self._env._elapsed_steps += self.amount
+            done = done or self._env._elapsed_steps >= self._env._max_episode_steps
+            return obs, total_reward, done, {}
+
         total_reward = 0
 
         for _ in range(self.amount):
@@ -43,15 +52,22 @@ class ActionRepeat(object):
     def reset(self, *args, **kwargs):
         return self._env.reset(*args, **kwargs)
 
+    def set_state(self, state):
+        # Start a new episode from a flattened simulator state, only the simulator is reset
+        # so no data such as solver warmstart carries over from the previous rollout
+        self._env._elapsed_steps = 0
+        self._env.sim.reset()
+        self._env.sim.set_state_from_flattened(state)
+
 
 def initializer(env):
     global global_env
     global_env = env
+    global_env.reset()
 
 
 def evaluate(actions, state):
-    global_env.reset()
-    global_env.sim.set_state(state)
+    global_env.set_state(state)
 
     score = 0
     for action in actions:
@@ -60,16 +76,31 @@ def evaluate(actions, state):
     return score
 
 
-def cem_planner(pool, action_space, state, horizon, proposals, topk, iterations):
+def evaluate_plans(pool, plans, state):
+    # Send a few chunks of plans to each worker, so that workers done early with cheap
+    # plans of terminated episodes pick up more, the state is pickled once per chunk
+    chunksize = math.ceil(len(plans) / (4 * NUM_WORKERS))
+    return pool.map(partial(evaluate, state=state), plans, chunksize=chunksize)
+
+
+def cem_planner(pool, rng, action_space, state, horizon, proposals, topk, iterations):
     action_bound = action_space.high[0]
     mean = np.zeros((horizon,) + action_space.shape)
-    std = np.ones((horizon,) + action_space.shape) * action_bound
+    std = np.full((horizon,) + action_space.shape, action_bound, dtype=float)
+
+    # Buffers refilled in place at every iteration
+    plans = np.empty((proposals,) + mean.shape)
+    clipped_plans = np.empty_like(plans)
 
     for _ in range(iterations):
-        plans = np.random.normal(mean, std, size=(proposals,) + mean.shape)
-        scores = pool.map(partial(evaluate, state=state), plans.clip(-action_bound, action_bound))
-        elites = plans[np.argsort(scores)][-topk:]
-        mean, std = elites.mean(axis=0), elites.std(axis=0)
+        rng.standard_normal(out=plans)
+        plans *= std
+        plans += mean
+        np.clip(plans, -action_bound, action_bound, out=clipped_plans)
+        scores = evaluate_plans(pool, clipped_plans, state)
+        elites = plans[np.argpartition(scores, -topk)[-topk:]]
+        elites.mean(axis=0, out=mean)
+        elites.std(axis=0, out=std)
 
     return mean[0].clip(-action_bound, action_bound)
 
@@ -82,13 +113,14 @@ def objective(space):
     iterations = 10
 
     # Pool of workers, each has its own copy of global environment variable
-    pool = Pool(32, initializer, [env])
+    pool = Pool(NUM_WORKERS, initializer, [env])
+    rng = np.random.default_rng()
 
     cost = 0
     env.reset()
     for _ in range(env.num_steps):
-        state = env.sim.get_state()
-        action = cem_planner(pool, env.action_space, state, int(space['horizon']),
+        state = env.sim.get_state().flatten()
+        action = cem_planner(pool, rng, env.action_space, state, int(space['horizon']),
                              proposals, int(space['topk']), iterations)
         _, reward, _, _ = env.step(action)
         cost -= reward
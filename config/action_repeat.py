@@ -18,6 +18,13 @@ class ActionRepeat(object):
         return self._env.dt
 
     def step(self, action):
+        if self.amount > 1 and getattr(self._env.unwrapped, 'supports_action_repeat', False):
+            # Repeat action in a single simulation call, bypassing the time limit wrapper
+            obs, total_reward, done, _ = self._env.unwrapped.step(action, repeat=self.amount)
+            self._env._elapsed_steps += self.amount
+            done = done or self._env._elapsed_steps >= self._env._max_episode_steps
+            return obs, total_reward, done, {}
+
         total_reward = 0
 
         for _ in range(self.amount):
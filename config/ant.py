@@ -11,10 +11,18 @@ class Config:
         action_repeat = 1
         self.env = ActionRepeat(env, action_repeat)
 
+        self.inv_dt = 1. / self.env.dt
+        self.amount = self.env.amount
+
         self.obs_features = self.env.observation_space.shape[0]
         self.obs_features_preprocessed = self.obs_features - 2
         self.act_features = self.env.action_space.shape[0]
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.inv_dt = 1. / self.env.dt
+        self.amount = self.env.amount
+
     def obs_preproc(self, obs):
         return obs[:, 2:]
 
@@ -25,10 +33,10 @@ class Config:
         return next_obs - obs
 
     def get_reward(self, obs, act, next_obs):
-        reward_run = (next_obs[:, 0] - obs[:, 0]) / self.env.dt
-        reward_act = -0.5 * (act ** 2).sum(dim=1) * self.env.amount
-        reward_contact = -0.5e-3 * (next_obs[:, -14 * 6:] ** 2).sum(dim=1) * self.env.amount
-        reward_alive = 1.0 * self.env.amount
+        reward_run = (next_obs[:, 0] - obs[:, 0]) * self.inv_dt
+        reward_act = -0.5 * (act ** 2).sum(dim=1) * self.amount
+        reward_contact = -0.5e-3 * (next_obs[:, -14 * 6:] ** 2).sum(dim=1) * self.amount
+        reward_alive = 1.0 * self.amount
         reward = reward_run + reward_act + reward_contact + reward_alive
         done = torch.max(next_obs[:, 2] < 0.2, next_obs[:, 2] > 1.0).float()
         return reward, done
@@ -63,6 +71,7 @@ class Config:
                           "pred_postproc": self.pred_postproc,
                           "targ_proc": self.targ_proc,
                           "get_reward": self.get_reward,
+                          "can_terminate": True,
                           "model_cfg": model_cfg,
                           "opt_cfg": opt_cfg})
 
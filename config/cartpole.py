@@ -12,6 +12,8 @@ class Config:
         action_repeat = 1
         self.env = ActionRepeat(env, action_repeat)
 
+        self.amount = self.env.amount
+
         self.obs_features = self.env.observation_space.shape[0]
         self.obs_features_preprocessed = self.obs_features + 1
         self.act_features = self.env.action_space.shape[0]
@@ -19,6 +21,10 @@ class Config:
         self.device = torch.device('cuda') if torch.cuda.is_available() else torch.device('cpu')
         self.ee_sub = torch.tensor([0.0, 0.6], device=self.device, dtype=torch.float)
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.amount = self.env.amount
+
     def obs_preproc(self, obs):
         if isinstance(obs, np.ndarray):
             return np.concatenate([obs[:, :1], np.sin(obs[:, 1:2]), np.cos(obs[:, 1:2]), obs[:, 2:]], axis=1)
@@ -36,8 +42,8 @@ class Config:
         ee_pos -= self.ee_sub
         ee_pos = ee_pos ** 2
         ee_pos = -ee_pos.sum(dim=1)
-        reward_obs = (ee_pos / (0.6 ** 2)).exp() * self.env.amount
-        reward_act = -0.01 * (act ** 2).sum(dim=1) * self.env.amount
+        reward_obs = (ee_pos / (0.6 ** 2)).exp() * self.amount
+        reward_act = -0.01 * (act ** 2).sum(dim=1) * self.amount
         reward = reward_obs + reward_act
         done = torch.zeros_like(reward)
         return reward, done
@@ -76,6 +82,7 @@ class Config:
                           "pred_postproc": self.pred_postproc,
                           "targ_proc": self.targ_proc,
                           "get_reward": self.get_reward,
+                          "can_terminate": False,
                           "model_cfg": model_cfg,
                           "opt_cfg": opt_cfg})
 
@@ -6,21 +6,44 @@ import torch
 from .action_repeat import ActionRepeat
 
 
+# Tensor functions called at every planning step, scripted to fuse elementwise operations
+@torch.jit.script
+def obs_preproc_torch(obs):
+    return torch.cat([obs[:, 1:2], obs[:, 2:3].sin(), obs[:, 2:3].cos(), obs[:, 3:]], dim=1)
+
+
+@torch.jit.script
+def get_reward_torch(obs, act, next_obs, inv_dt: float, amount: float):
+    reward_run = (next_obs[:, 0] - obs[:, 0]) * inv_dt
+    reward_act = -0.1 * (act ** 2).sum(dim=1) * amount
+    reward = reward_act + reward_run
+    done = torch.zeros_like(reward)
+    return reward, done
+
+
 class Config:
     def __init__(self):
         env = gym.make("MyHalfCheetah-v2")
         action_repeat = 1
         self.env = ActionRepeat(env, action_repeat)
 
+        self.inv_dt = 1. / self.env.dt
+        self.amount = self.env.amount
+
         self.obs_features = self.env.observation_space.shape[0]
         self.obs_features_preprocessed = self.obs_features
         self.act_features = self.env.action_space.shape[0]
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.inv_dt = 1. / self.env.dt
+        self.amount = self.env.amount
+
     def obs_preproc(self, obs):
         if isinstance(obs, np.ndarray):
             return np.concatenate([obs[:, 1:2], np.sin(obs[:, 2:3]), np.cos(obs[:, 2:3]), obs[:, 3:]], axis=1)
         else:
-            return torch.cat([obs[:, 1:2], obs[:, 2:3].sin(), obs[:, 2:3].cos(), obs[:, 3:]], dim=1)
+            return obs_preproc_torch(obs)
 
     def pred_postproc(self, obs, pred):
         return obs + pred
@@ -29,11 +52,7 @@ class Config:
         return next_obs - obs
 
     def get_reward(self, obs, act, next_obs):
-        reward_run = (next_obs[:, 0] - obs[:, 0]) / self.env.dt
-        reward_act = -0.1 * (act ** 2).sum(dim=1) * self.env.amount
-        reward = reward_act + reward_run
-        done = torch.zeros_like(reward)
-        return reward, done
+        return get_reward_torch(obs, act, next_obs, self.inv_dt, float(self.amount))
 
     def get_config(self):
         exp_cfg = DotMap({"env": self.env,
@@ -65,6 +84,7 @@ class Config:
                           "pred_postproc": self.pred_postproc,
                           "targ_proc": self.targ_proc,
                           "get_reward": self.get_reward,
+                          "can_terminate": False,
                           "model_cfg": model_cfg,
                           "opt_cfg": opt_cfg})
 
@@ -11,10 +11,18 @@ class Config:
         action_repeat = 2
         self.env = ActionRepeat(env, action_repeat)
 
+        self.inv_dt = 1. / self.env.dt
+        self.amount = self.env.amount
+
         self.obs_features = self.env.observation_space.shape[0]
         self.obs_features_preprocessed = self.obs_features - 14 * 4
         self.act_features = self.env.action_space.shape[0]
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.inv_dt = 1. / self.env.dt
+        self.amount = self.env.amount
+
     def obs_preproc(self, obs):
         return obs[:, 14 * 4:]
 
@@ -29,10 +37,10 @@ class Config:
         return ((mass * xpos).sum(dim=1) / mass.sum(dim=(1, 2)).view(-1, 1))[:, 0]
 
     def get_reward(self, obs, act, next_obs):
-        reward_run = 1.25 * (self._mass_center(next_obs) - self._mass_center(obs)) / self.env.dt
-        reward_act = -0.1 * (act ** 2).sum(dim=1) * self.env.amount
-        reward_contact = max(-0.5e-6 * (next_obs[:, -14 * 6:] ** 2).sum(), -10) * self.env.amount
-        reward_alive = 5.0 * self.env.amount
+        reward_run = 1.25 * (self._mass_center(next_obs) - self._mass_center(obs)) * self.inv_dt
+        reward_act = -0.1 * (act ** 2).sum(dim=1) * self.amount
+        reward_contact = max(-0.5e-6 * (next_obs[:, -14 * 6:] ** 2).sum(), -10) * self.amount
+        reward_alive = 5.0 * self.amount
         reward = reward_run + reward_act + reward_contact + reward_alive
         done = torch.max(next_obs[:, 14 * 4] < 1.0, next_obs[:, 14 * 4] > 2.0).float()
         return reward, done
@@ -67,6 +75,7 @@ class Config:
                           "pred_postproc": self.pred_postproc,
                           "targ_proc": self.targ_proc,
                           "get_reward": self.get_reward,
+                          "can_terminate": True,
                           "model_cfg": model_cfg,
                           "opt_cfg": opt_cfg})
 
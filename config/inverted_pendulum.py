@@ -11,10 +11,16 @@ class Config:
         action_repeat = 1
         self.env = ActionRepeat(env, action_repeat)
 
+        self.amount = self.env.amount
+
         self.obs_features = self.env.observation_space.shape[0]
         self.obs_features_preprocessed = self.obs_features
         self.act_features = self.env.action_space.shape[0]
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.amount = self.env.amount
+
     def obs_preproc(self, obs):
         return obs
 
@@ -25,7 +31,7 @@ class Config:
         return next_obs - obs
 
     def get_reward(self, obs, act, next_obs):
-        reward = torch.ones(obs.shape[0]).to(obs.device) * self.env.amount
+        reward = torch.ones(obs.shape[0]).to(obs.device) * self.amount
         done = (torch.abs(next_obs[:, 1]) > 0.2).float()
         return reward, done
 
@@ -59,6 +65,7 @@ class Config:
                           "pred_postproc": self.pred_postproc,
                           "targ_proc": self.targ_proc,
                           "get_reward": self.get_reward,
+                          "can_terminate": True,
                           "model_cfg": model_cfg,
                           "opt_cfg": opt_cfg})
 
@@ -12,10 +12,16 @@ class Config:
         action_repeat = 1
         self.env = ActionRepeat(env, action_repeat)
 
+        self.amount = self.env.amount
+
         self.obs_features = self.env.observation_space.shape[0]
         self.obs_features_preprocessed = self.obs_features
         self.act_features = self.env.action_space.shape[0]
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.amount = self.env.amount
+
     def obs_preproc(self, obs):
         return obs
 
@@ -32,9 +38,9 @@ class Config:
 
     def get_reward(self, obs, act, next_obs):
         tip_pos, obj_pos, goal_pos = obs[:, 14:17], obs[:, 17:20], obs[:, 20:23]
-        reward_near = -torch.norm(obj_pos - tip_pos, dim=1) * self.env.amount
-        reward_dist = -torch.norm(obj_pos - goal_pos, dim=1) * self.env.amount
-        reward_act = -(act ** 2).sum(dim=1) * self.env.amount
+        reward_near = -torch.norm(obj_pos - tip_pos, dim=1) * self.amount
+        reward_dist = -torch.norm(obj_pos - goal_pos, dim=1) * self.amount
+        reward_act = -(act ** 2).sum(dim=1) * self.amount
         reward = reward_dist + 0.1 * reward_act + 0.5 * reward_near
         done = torch.zeros_like(reward)
         return reward, done
@@ -69,6 +75,7 @@ class Config:
                           "pred_postproc": self.pred_postproc,
                           "targ_proc": self.targ_proc,
                           "get_reward": self.get_reward,
+                          "can_terminate": False,
                           "model_cfg": model_cfg,
                           "opt_cfg": opt_cfg})
 
@@ -10,10 +10,18 @@ class Config:
         action_repeat = 2
         self.env = ActionRepeat(env, action_repeat)
 
+        self.inv_dt = 1. / self.env.dt
+        self.amount = self.env.amount
+
         self.obs_features = self.env.observation_space.shape[0]
         self.obs_features_preprocessed = self.obs_features - 1
         self.act_features = self.env.action_space.shape[0]
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.inv_dt = 1. / self.env.dt
+        self.amount = self.env.amount
+
     def obs_preproc(self, obs):
         return obs[:, 1:]
 
@@ -24,9 +32,9 @@ class Config:
         return next_obs - obs
 
     def get_reward(self, obs, act, next_obs):
-        reward_run = (next_obs[:, 0] - obs[:, 0]) / self.env.dt
-        reward_act = -1e-3 * (act ** 2).sum(dim=1) * self.env.amount
-        reward_alive = 1.0 * self.env.amount
+        reward_run = (next_obs[:, 0] - obs[:, 0]) * self.inv_dt
+        reward_act = -1e-3 * (act ** 2).sum(dim=1) * self.amount
+        reward_alive = 1.0 * self.amount
         reward = reward_run + reward_act + reward_alive
         height, ang = next_obs[:, 1], next_obs[:, 2]
         done = (1 - (height > 0.8) * (height < 2.0) * (ang > -1.0) * (ang < 1.0)).float()
@@ -62,6 +70,7 @@ class Config:
                           "pred_postproc": self.pred_postproc,
                           "targ_proc": self.targ_proc,
                           "get_reward": self.get_reward,
+                          "can_terminate": True,
                           "model_cfg": model_cfg,
                           "opt_cfg": opt_cfg})
 
@@ -1,4 +1,3 @@
-from torch.utils.data import TensorDataset
 import time
 import math
 
@@ -28,6 +27,8 @@ class MPC:
                     learns the mapping obs -> targ_proc(obs, next_obs)).
                 .get_reward (func): A function which computes the reward of a batch of
                     transitions.
+                .can_terminate (bool): Whether get_reward can return done flags, in which case
+                    plans whose particles are all done are dropped from rollouts.
 
                 .model_cfg (DotMap): A DotMap of model parameters.
                     .ensemble_size (int): Number of bootstrap model.
@@ -43,9 +44,17 @@ class MPC:
                     .iterations (int): The number of iterations to perform during CEM
                         optimization.
                     .popsize (int): The number of candidate solutions to be sampled at
-                        every iteration
+                        the first iteration.
                     .num_elites (int): The number of top solutions that will be used to
                         obtain the distribution at the next iteration.
+                    .noise_beta (float, optional): Exponent of the power spectral density of
+                        the sampling noise over the planning horizon.
+                    .popsize_decay (float, optional): Factor by which the population size is
+                        multiplied at every iteration.
+                    .keep_elites (float, optional): Fraction of the elites of an iteration
+                        added to the candidate solutions of the next iteration.
+                    .converge_tol (float, optional): Optimization stops early once the
+                        standard deviation of elites is below converge_tol * action bound.
         """
         self.env = args.env
         self.act_features = args.env.action_space.shape[0]
@@ -62,6 +71,7 @@ class MPC:
         self.pred_postproc = args.pred_postproc
         self.targ_proc = args.targ_proc
         self.get_reward = args.get_reward
+        self.can_terminate = args.can_terminate
 
         self.has_been_trained = False
         # Check arguments
@@ -73,6 +83,25 @@ class MPC:
         # Bootstrap ensemble model
         self.model = BootstrapEnsemble(**args.model_cfg)
 
+        # One-step rollout function, compiled on first use
+        self._compiled_step = None
+
+    def __getstate__(self):
+        # Compiled functions can't be pickled, the rollout step is recompiled after loading
+        state = self.__dict__.copy()
+        state['_compiled_step'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Controllers pickled by older versions lack the attributes added since
+        state.setdefault('_compiled_step', None)
+        state.setdefault('can_terminate', False)
+        # The training set is kept on device, older versions kept it on cpu
+        for key in ('X', 'Y'):
+            if key in state:
+                state[key] = state[key].to(TORCH_DEVICE)
+        self.__dict__.update(state)
+
     def train_initial(self, obs, acts, train_split=0.8, debug_logger=None):
         """Create dataset and train bootstrap ensemble model until overfitting.
 
@@ -93,17 +122,15 @@ class MPC:
 
         # Store input statistics for normalization
         self.model.fit_input_stats(self.X)
-        
-        dataset = TensorDataset(self.X, self.Y)
-        train_size = int(train_split * len(dataset))
-        val_size = len(dataset) - train_size
+
+        train_size = int(train_split * len(self.X))
+        val_size = len(self.X) - train_size
 
         # Bootstrap ensemble train and validation indexes
-        idxs = [torch.randperm(len(dataset)) for _ in range(self.num_nets)]
-        train_idxs = torch.stack([i[:train_size] for i in idxs])
-        val_idxs = torch.stack([i[train_size:] for i in idxs])
+        idxs = self._random_permutations(len(self.X))
+        train_idxs, val_idxs = idxs[:, :train_size], idxs[:, train_size:]
 
-        batch_size = int(len(dataset) / self.batches_per_epoch)
+        batch_size = int(len(self.X) / self.batches_per_epoch)
         train_batches = int(train_split * self.batches_per_epoch)
         val_batches = self.batches_per_epoch - train_batches
 
@@ -114,21 +141,21 @@ class MPC:
         epoch = 0
         while not early_stopping.early_stop:
             epoch += 1
-            train_idxs_epoch = train_idxs[:, torch.randperm(train_size)]
-            val_idxs_epoch = val_idxs[:, torch.randperm(val_size)]
+            train_idxs_epoch = train_idxs.gather(1, self._random_permutations(train_size))
+            val_idxs_epoch = val_idxs.gather(1, self._random_permutations(val_size))
 
             self.model.net.train()
             train_metrics = Metrics()
             for i in range(train_batches):
-                X, Y = dataset[train_idxs_epoch[:, i*batch_size:(i+1)*batch_size]]
-                X, Y = X.to(TORCH_DEVICE), Y.to(TORCH_DEVICE)
+                batch_idxs = train_idxs_epoch[:, i*batch_size:(i+1)*batch_size]
+                X, Y = self.X[batch_idxs], self.Y[batch_idxs]
                 train_metrics.store(self.model.update(X, Y))
 
             self.model.net.eval()
             val_metrics = Metrics()
             for i in range(val_batches):
-                X, Y = dataset[val_idxs_epoch[:, i*batch_size:(i+1)*batch_size]]
-                X, Y = X.to(TORCH_DEVICE), Y.to(TORCH_DEVICE)
+                batch_idxs = val_idxs_epoch[:, i*batch_size:(i+1)*batch_size]
+                X, Y = self.X[batch_idxs], self.Y[batch_idxs]
                 val_metrics.store(self.model.evaluate_val(X, Y))
 
             info_epoch = {'metrics': {}, 'weights': {}}
@@ -173,24 +200,23 @@ class MPC:
         # Record mse and cross-entropy on new test data
         metrics = {}
         self.model.net.eval()
-        metrics.update(self.model.evaluate_test(X_new.to(TORCH_DEVICE), Y_new.to(TORCH_DEVICE)))
+        metrics.update(self.model.evaluate_test(X_new, Y_new))
 
         # Store input statistics for normalization
         self.model.fit_input_stats(self.X)
 
-        dataset = TensorDataset(self.X, self.Y)
-        batch_size = int(len(dataset) / self.batches_per_epoch)
+        batch_size = int(len(self.X) / self.batches_per_epoch)
 
         # Training loop
         start = time.time()
         for epoch in range(self.train_epochs):
-            idxs = torch.stack([torch.randperm(len(dataset)) for _ in range(self.num_nets)])
+            idxs = self._random_permutations(len(self.X))
 
             self.model.net.train()
             epoch_metrics = Metrics()
             for i in range(self.batches_per_epoch):
-                X, Y = dataset[idxs[:, i * batch_size:(i + 1) * batch_size]]
-                X, Y = X.to(TORCH_DEVICE), Y.to(TORCH_DEVICE)
+                batch_idxs = idxs[:, i * batch_size:(i + 1) * batch_size]
+                X, Y = self.X[batch_idxs], self.Y[batch_idxs]
                 epoch_metrics.store(self.model.update(X, Y))
 
         metrics.update(epoch_metrics.average())
@@ -201,6 +227,10 @@ class MPC:
 
         return metrics, weights
 
+    def _random_permutations(self, n):
+        # One random permutation of range(n) per model in ensemble, drawn in a single kernel
+        return torch.rand(self.num_nets, n, device=TORCH_DEVICE).argsort(dim=1)
+
     def _preprocess_train_data(self, obs, acts):
         """Preprocess observations and actions for dynamics model training set.
 
@@ -209,14 +239,22 @@ class MPC:
             acts (list[2D np.ndarray]): actions
 
         Returns:
-            X (2D torch.Tensor): inputs
-            Y (2D torch.Tensor): targets
+            X (2D torch.Tensor): inputs on device
+            Y (2D torch.Tensor): targets on device
         """
-        X = [np.concatenate([self.obs_preproc(o[:-1]), a], axis=1) for o, a in zip(obs, acts)]
-        Y = [self.targ_proc(o[:-1], o[1:]) for o in obs]
-        X, Y = np.concatenate(X, axis=0), np.concatenate(Y, axis=0)
+        # Concatenate transitions of all trajectories and preprocess them at once, in single
+        # precision so that conversion to tensors doesn't copy
+        cur_obs = np.concatenate([o[:-1] for o in obs], axis=0, dtype=np.float32)
+        next_obs = np.concatenate([o[1:] for o in obs], axis=0, dtype=np.float32)
+        acts = np.concatenate(acts, axis=0, dtype=np.float32)
+
+        proc_obs = self.obs_preproc(cur_obs)
+        obs_features = proc_obs.shape[1]
+        X = np.empty((len(cur_obs), obs_features + acts.shape[1]), dtype=np.float32)
+        X[:, :obs_features], X[:, obs_features:] = proc_obs, acts
+        Y = self.targ_proc(cur_obs, next_obs)
         X, Y = torch.from_numpy(X).float(), torch.from_numpy(Y).float()
-        return X, Y
+        return X.to(TORCH_DEVICE), Y.to(TORCH_DEVICE)
 
     def act(self, obs):
         """Return the action that this controller would take for a single observation obs.
@@ -274,52 +312,82 @@ class MPC:
         """
         assert batch_size % self.num_part == 0
         num_obs, num_plans = plans.shape[:2]
+        part_per_net = self.num_part // self.num_nets
 
-        # Reshape plans for parallel computation
+        # Reshape plans for parallel computation, particles are only created per step
         # 1 - (num_obs, num_plans, plan_hor * act_features)
-        # 2 - (num_obs, num_plans, plan_hor, act_features)
-        # 3 - (num_obs, num_plans, num_part, plan_hor, act_features)
-        # 4 - (num_obs * num_plans * num_part, plan_hor, act_features)
-        plans = plans.view(num_obs, num_plans, self.plan_hor, self.act_features)
-        plans = plans.unsqueeze(2).expand(-1, -1, self.num_part, -1, -1).contiguous()
+        # 2 - (num_obs * num_plans, plan_hor, act_features)
         plans = plans.view(-1, self.plan_hor, self.act_features)
 
-        # Reshape observations for parallel computation
-        # 1 - (num_obs, obs_features)
-        # 2 - (num_obs * num_plans * num_part, obs_features)
-        obs = cur_obs.repeat(num_plans * self.num_part, 1)
+        # Plans and starting observations are copied to device once for all batches
+        plans, cur_obs = plans.to(TORCH_DEVICE), cur_obs.to(TORCH_DEVICE)
 
-        dataset = TensorDataset(obs, plans)
-        num_batches = math.ceil(len(dataset) / batch_size)
-        scores = torch.zeros(num_obs * num_plans * self.num_part).to(TORCH_DEVICE)
+        num_all_plans = num_obs * num_plans
+        plans_per_batch = batch_size // self.num_part
+        num_batches = math.ceil(num_all_plans / plans_per_batch)
+        scores = torch.zeros(self.num_nets, num_all_plans, part_per_net, device=TORCH_DEVICE)
+
+        # Particle statistics are kept on device and transferred once after all rollouts
+        obs_stds = []
 
         # Compute scores in parallel
         # Across starting observations, plans per observation and particles per plan
         for i in range(num_batches):
-            obs, plans = dataset[i * batch_size:(i+1) * batch_size]
-            obs, plans = obs.to(TORCH_DEVICE), plans.to(TORCH_DEVICE)
+            start, end = i * plans_per_batch, min((i+1) * plans_per_batch, num_all_plans)
+
+            # Starting observations are gathered from cur_obs instead of being repeated
+            # for every plan, plan p starts from observation p // num_plans
+            obs_idxs = torch.arange(start, end, device=TORCH_DEVICE)
+            obs_idxs = torch.div(obs_idxs, num_plans, rounding_mode='floor')
+            obs = self._to_particles(cur_obs[obs_idxs])
+            batch_plans = plans[start:end]
             alives = torch.ones(obs.shape[0]).to(TORCH_DEVICE)
 
+            # Plans of the batch whose particles are still propagated
+            plan_idxs, compacted = slice(start, end), False
+
             for t in range(self.plan_hor):
-                acts = plans[:, t]
-                next_obs = self._predict_next_obs_divide(obs, acts)
+                acts = self._to_particles(batch_plans[:, t])
+                # Compacted batches have varying shapes, they are propagated without compilation
+                step_function = self._rollout_step if compacted else self._step_function()
+                next_obs, rewards, alives = step_function(obs, acts, alives)
+                # Outputs of the captured graph are overwritten at the next replay
+                obs, alives = next_obs.clone(), alives.clone()
 
                 # Measure diversity among particles by observation std dev
                 if particle_info is not None:
-                    obs_std = next_obs.view(-1, self.num_part, self.obs_features).std(dim=1).cpu()
-                    metrics = {}; log_statistics(metrics, obs_std, 'particle/obs_std')
-                    particle_info.store(metrics)
+                    obs_std = next_obs.view(self.num_nets, -1, part_per_net, self.obs_features)
+                    obs_stds.append(obs_std.std(dim=(0, 2)).flatten())
 
-                # Compute rewards and done flags
-                rewards, dones = self.get_reward(obs, acts, next_obs)
-                alives = torch.min(alives, 1 - dones)
-                scores[i * batch_size:(i+1) * batch_size] += alives * rewards
+                scores[:, plan_idxs] += (alives * rewards).view(self.num_nets, -1, part_per_net)
 
-                obs = next_obs
                 if alives.sum() == 0:
                     break
 
-        scores = scores.view(num_obs, num_plans, self.num_part)
+                # Every few steps, stop propagating plans whose particles are all dead if they
+                # make up more than half of the batch
+                if self.can_terminate and (t + 1) % 5 == 0:
+                    plan_alives = alives.view(self.num_nets, -1, part_per_net).amax(dim=(0, 2)) > 0
+                    if plan_alives.sum() < 0.5 * len(plan_alives):
+                        keep = plan_alives.nonzero().squeeze(1)
+                        if not compacted:
+                            plan_idxs, compacted = torch.arange(start, end, device=TORCH_DEVICE), True
+                        plan_idxs, batch_plans = plan_idxs[keep], batch_plans[keep]
+                        obs = obs.view(self.num_nets, -1, part_per_net, self.obs_features)[:, keep]
+                        obs = obs.reshape(-1, self.obs_features)
+                        alives = alives.view(self.num_nets, -1, part_per_net)[:, keep].reshape(-1)
+
+        # Reorder scores from ensemble-major particle layout
+        # 1 - (num_nets, num_obs * num_plans, num_part / num_nets)
+        # 2 - (num_obs * num_plans, num_nets, num_part / num_nets)
+        # 3 - (num_obs, num_plans, num_part)
+        scores = scores.transpose(0, 1).reshape(num_obs, num_plans, self.num_part)
+
+        # Measure diversity among particles by observation std dev at every step
+        if particle_info is not None:
+            for obs_std in torch.cat(obs_stds).cpu().split([len(s) for s in obs_stds]):
+                metrics = {}; log_statistics(metrics, obs_std, 'particle/obs_std')
+                particle_info.store(metrics)
 
         # Measure diversity among particles by score std dev
         if particle_info is not None:
@@ -331,6 +399,38 @@ class MPC:
         # Average score over particles
         return scores.mean(dim=-1).cpu()
 
+    def _step_function(self):
+        # Compile one-step rollout function once, graphs are then replayed at every step.
+        # The number of particles changes across CEM iterations with the population size,
+        # shapes are kept dynamic so that every size reuses the same compiled function
+        if self._compiled_step is None:
+            if hasattr(torch, 'compile'):
+                self._compiled_step = torch.compile(self._rollout_step, mode='reduce-overhead',
+                                                    dynamic=True)
+            else:
+                self._compiled_step = self._rollout_step
+        if hasattr(torch, 'compiler') and hasattr(torch.compiler, 'cudagraph_mark_step_begin'):
+            torch.compiler.cudagraph_mark_step_begin()
+        return self._compiled_step
+
+    def _rollout_step(self, obs, acts, alives):
+        """Propagate particles by one step under the learned dynamics, without side effects.
+
+        Arguments:
+            obs (2D torch.Tensor): Observations.
+            acts (2D torch.Tensor): Actions.
+            alives (1D torch.Tensor): Alive flags of particles.
+
+        Returns:
+            next_obs (2D torch.Tensor): Next observations.
+            rewards (1D torch.Tensor): Rewards of transitions.
+            alives (1D torch.Tensor): Alive flags of particles after transitions.
+        """
+        next_obs = self._predict_next_obs_divide(obs, acts)
+        rewards, dones = self.get_reward(obs, acts, next_obs)
+        alives = torch.min(alives, 1 - dones)
+        return next_obs, rewards, alives
+
     def _predict_next_obs_average(self, obs, acts):
         """Predict next observation by averaging predictions of all models in ensemble.
 
@@ -354,6 +454,9 @@ class MPC:
     def _predict_next_obs_divide(self, obs, acts):
         """Predict next observation by dividing predictions among models in ensemble.
 
+        Particles must be laid out ensemble-major, as returned by _to_particles(), so that
+        particles are divided among models in ensemble without copies.
+
          Arguments:
             obs (2D torch.Tensor): Observations.
             acts (2D torch.Tensor): Actions.
@@ -364,6 +467,7 @@ class MPC:
         proc_obs = self.obs_preproc(obs)
 
         # Predict next observations, by dividing particles among models in ensemble
+        # (all models are evaluated at once, each layer being a single batched matmul)
         input = self._to_bootstrap_shape(torch.cat((proc_obs, acts), dim=-1))
         preds = self.model.sample(input)
         preds = self._from_bootstrap_shape(preds)
@@ -371,22 +475,25 @@ class MPC:
         # Postprocess predictions
         return self.pred_postproc(obs, preds)
 
-    def _to_bootstrap_shape(self, input):
-        # Reshape matrix to be processed by bootstrap ensemble model
-        # 1 - (x * num_part, num_features)
-        # 2 - (x, num_nets, num_parts / num_nets, num_features)
-        # 3 - (num_nets, x * (num_parts / num_nets), num_features)
+    def _to_particles(self, input):
+        # Expand matrix with one row per plan to particles laid out ensemble-major
+        # 1 - (x, num_features)
+        # 2 - (num_nets, x, num_part / num_nets, num_features)
+        # 3 - (num_nets * x * (num_part / num_nets), num_features)
         num_features = input.shape[-1]
-        reshaped = input.view(-1, self.num_nets, self.num_part // self.num_nets, num_features)
-        reshaped = reshaped.transpose(0, 1).contiguous().view(self.num_nets, -1, num_features)
-        return reshaped
+        expanded = input.unsqueeze(0).unsqueeze(2)
+        expanded = expanded.expand(self.num_nets, -1, self.num_part // self.num_nets, -1)
+        return expanded.reshape(-1, num_features)
+
+    def _to_bootstrap_shape(self, input):
+        # Reshape matrix of particles laid out ensemble-major to be processed by bootstrap
+        # ensemble model, without copy
+        # 1 - (num_nets * x * (num_part / num_nets), num_features)
+        # 2 - (num_nets, x * (num_part / num_nets), num_features)
+        return input.view(self.num_nets, -1, input.shape[-1])
 
     def _from_bootstrap_shape(self, input):
-        # Reshape 3D tensor processed by bootstrap ensemble model to matrix
-        # 1 - (num_nets, x * (num_parts / num_nets), num_features)
-        # 2 - (num_nets, x, num_part / num_nets, num_features)
-        # 3 - (x * num_part, num_features)
-        num_features = input.shape[-1]
-        reshaped = input.view(self.num_nets, -1, self.num_part // self.num_nets, num_features)
-        reshaped = reshaped.transpose(0, 1).contiguous().view(-1, num_features)
-        return reshaped
\ No newline at end of file
+        # Reshape 3D tensor processed by bootstrap ensemble model to matrix, without copy
+        # 1 - (num_nets, x * (num_part / num_nets), num_features)
+        # 2 - (num_nets * x * (num_part / num_nets), num_features)
+        return input.view(-1, input.shape[-1])
\ No newline at end of file
@@ -5,17 +5,21 @@ from gym.envs.mujoco import mujoco_env
 
 
 class HalfCheetahEnv(mujoco_env.MujocoEnv, utils.EzPickle):
+    # Rewards of repeated actions add up exactly and the episode never terminates,
+    # so step() can repeat an action in a single simulation call
+    supports_action_repeat = True
+
     def __init__(self):
         dir_path = os.path.dirname(os.path.realpath(__file__))
         mujoco_env.MujocoEnv.__init__(self, '%s/assets/half_cheetah.xml' % dir_path, 5)
         utils.EzPickle.__init__(self)
 
-    def step(self, action):
+    def step(self, action, repeat=1):
         xposbefore = self.sim.data.qpos[0]
-        self.do_simulation(action, self.frame_skip)
+        self.do_simulation(action, self.frame_skip * repeat)
         xposafter = self.sim.data.qpos[0]
 
-        reward_act = -0.1 * np.square(action).sum()
+        reward_act = -0.1 * np.square(action).sum() * repeat
         reward_run = (xposafter - xposbefore) / self.dt
         reward = reward_run + reward_act
 
@@ -5,17 +5,21 @@ from gym.envs.mujoco import mujoco_env
 
 
 class SwimmerEnv(mujoco_env.MujocoEnv, utils.EzPickle):
+    # Rewards of repeated actions add up exactly and the episode never terminates,
+    # so step() can repeat an action in a single simulation call
+    supports_action_repeat = True
+
     def __init__(self):
         dir_path = os.path.dirname(os.path.realpath(__file__))
         mujoco_env.MujocoEnv.__init__(self, '%s/assets/swimmer.xml' % dir_path, 4)
         utils.EzPickle.__init__(self)
 
-    def step(self, action):
+    def step(self, action, repeat=1):
         xposbefore = self.sim.data.qpos[0]
-        self.do_simulation(action, self.frame_skip)
+        self.do_simulation(action, self.frame_skip * repeat)
         xposafter = self.sim.data.qpos[0]
 
-        reward_act = -1e-4 * np.square(action).sum()
+        reward_act = -1e-4 * np.square(action).sum() * repeat
         reward_fwd = (xposafter - xposbefore) / self.dt
         reward = reward_fwd + reward_act
 
@@ -13,7 +13,8 @@ class BootstrapLinear(nn.Module):
             out_features (int): size of each output sample
 
         Shape:
-            - Input: (ensemble_size, batch_size, in_features)
+            - Input: (ensemble_size, batch_size, in_features) or (batch_size, in_features)
+                to feed the same input to every model in the ensemble
             - Output: (ensemble_size, batch_size, out_features)
 
         Attributes:
@@ -33,7 +34,10 @@ class BootstrapLinear(nn.Module):
         nn.init.zeros_(self.bias)
 
     def forward(self, input):
-        return input.matmul(self.weight) + self.bias
+        if input.dim() == 2:
+            input = input.expand(self.weight.shape[0], -1, -1)
+        # Fused batched matmul and bias addition over the ensemble dimension
+        return torch.baddbmm(self.bias, input, self.weight)
 
 
 class BootstrapGaussian(nn.Module):
@@ -1,18 +1,63 @@
+import math
 import torch
-from torch.distributions import Normal
+
+
+def colored_noise(beta, size):
+    """Sample Gaussian noise with unit variance and power spectral density proportional
+    to 1 / f^beta along the last dimension.
+
+    Arguments:
+        beta (float): Exponent of the power spectral density, 0 gives white noise and larger
+            values give noise more correlated in time.
+        size (tuple): Shape of samples, the last dimension being time.
+
+    Returns: Noise samples (torch.Tensor).
+    """
+    # Scale white noise in frequency domain, the zero frequency is scaled as the lowest one
+    samples = size[-1]
+    freqs = torch.fft.rfftfreq(samples)
+    freqs[0] = 1. / samples
+    scale = freqs ** (-beta / 2.)
+
+    # Standard deviation of the resulting time series, used to normalize it
+    variance = 2 * scale[0] ** 2 + 4 * torch.sum(scale[1:] ** 2)
+    if samples % 2 == 0:
+        variance -= 2 * scale[-1] ** 2
+    sigma = torch.sqrt(variance) / samples
+
+    real = torch.randn(size[:-1] + (len(freqs),)) * scale
+    imag = torch.randn(size[:-1] + (len(freqs),)) * scale
+    # Zero and Nyquist frequency components of a real signal are real
+    if samples % 2 == 0:
+        imag[..., -1] = 0
+        real[..., -1] *= math.sqrt(2)
+    imag[..., 0] = 0
+    real[..., 0] *= math.sqrt(2)
+
+    return torch.fft.irfft(torch.complex(real, imag), n=samples) / sigma
 
 
 class CEMOptimizer:
-    def __init__(self, action_space, horizon, popsize, num_elites, iterations):
-        """Cross-entropy method optimizer.
+    def __init__(self, action_space, horizon, popsize, num_elites, iterations, noise_beta=2.5,
+                 popsize_decay=0.7, keep_elites=0.3, converge_tol=0.05):
+        """Cross-entropy method optimizer, with the sampling improvements of iCEM: colored noise,
+        decaying population size, elites kept across iterations and mean added as a sample.
 
         Arguments:
             action_space: OpenAI gym action space.
             horizon (int): Planning horizon.
-            popsize (int): The number of candidate solutions to be sampled at every iteration
+            popsize (int): The number of candidate solutions to be sampled at the first iteration
             num_elites (int): The number of top solutions that will be used to obtain the
                 distribution at the next iteration.
             iterations (int): The number of iterations to perform during optimization.
+            noise_beta (float): Exponent of the power spectral density of the sampling noise
+                over the planning horizon, 0 gives white noise as in standard CEM.
+            popsize_decay (float): Factor by which the population size is multiplied at every
+                iteration, down to twice the number of elites.
+            keep_elites (float): Fraction of the elites of an iteration added to the candidate
+                solutions of the next iteration.
+            converge_tol (float): Optimization stops early once the standard deviation of elites
+                is below converge_tol * action bound for all actions of all plans.
         """
         self.act_bound = action_space.high[0]
         self.action_shape = action_space.shape
@@ -20,9 +65,21 @@ class CEMOptimizer:
         self.popsize = popsize
         self.num_elites = num_elites
         self.iterations = iterations
+        self.noise_beta = noise_beta
+        self.popsize_decay = popsize_decay
+        self.num_kept_elites = int(keep_elites * num_elites)
+        self.converge_tol = converge_tol
 
         assert num_elites <= popsize, "Number of elites must be at most the population size."
 
+    def __setstate__(self, state):
+        # Optimizers pickled by older versions run plain CEM
+        state.setdefault('noise_beta', 0.)
+        state.setdefault('popsize_decay', 1.)
+        state.setdefault('num_kept_elites', 0)
+        state.setdefault('converge_tol', 0.)
+        self.__dict__.update(state)
+
     def obtain_solution(self, start_obs, score_function, particle_info):
         """Optimize multiple CEM planning instances in parallel.
 
@@ -35,11 +92,31 @@ class CEMOptimizer:
         num_obs = start_obs.shape[0]
         mean = torch.zeros((num_obs, self.horizon) + self.action_shape)
         std = torch.ones((num_obs, self.horizon) + self.action_shape) * self.act_bound
+        elites = None
+
+        for i in range(self.iterations):
+            popsize = max(int(self.popsize * self.popsize_decay ** i),
+                          min(2 * self.num_elites, self.popsize))
+
+            # Sample noise correlated over the planning horizon, of shape
+            # (num_obs, popsize, horizon, action_features)
+            noise_size = (num_obs, popsize) + self.action_shape + (self.horizon,)
+            noise = colored_noise(self.noise_beta, noise_size)
+            plans = mean.unsqueeze(1) + std.unsqueeze(1) * noise.movedim(-1, 2)
+
+            # Add best elites of previous iteration, and mean at the last iteration
+            if elites is not None and self.num_kept_elites > 0:
+                plans = torch.cat((plans, elites[:, :self.num_kept_elites]), dim=1)
+            if i == self.iterations - 1:
+                plans = torch.cat((plans, mean.unsqueeze(1)), dim=1)
 
-        for _ in range(self.iterations):
-            plans = Normal(mean, std).sample((self.popsize,)).transpose(0, 1)
             scores = score_function(plans.clamp(-self.act_bound, self.act_bound), start_obs, particle_info)
-            elites = torch.stack([p[torch.argsort(s)][-self.num_elites:] for p, s in zip(plans, scores)])
+            elite_idxs = torch.topk(scores, self.num_elites, dim=1).indices
+            elites = plans[torch.arange(num_obs).unsqueeze(1), elite_idxs]
             mean, std = torch.mean(elites, dim=1), torch.std(elites, dim=1)
 
-        return mean.clamp(-self.act_bound, self.act_bound)
\ No newline at end of file
+            # Stop once the sampling distribution has collapsed
+            if torch.max(std).item() < self.converge_tol * self.act_bound:
+                break
+
+        return mean.clamp(-self.act_bound, self.act_bound)